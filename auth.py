@@ -0,0 +1,114 @@
+"""
+Shared Kite session + instrument-metadata helpers.
+
+Imported by streamlit_app.py (and any future auxiliary pages) so the
+session DB, the cached authenticated client, and the instruments cache
+exist exactly once per process instead of being redefined per page.
+"""
+
+import sqlite3
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+import streamlit as st
+from kiteconnect import KiteConnect
+from requests.adapters import HTTPAdapter
+
+# -------------------------------
+# SQLite Token Persistence
+# -------------------------------
+DB_PATH = "kite_session.db"
+
+def init_db():
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS session (key TEXT PRIMARY KEY, value TEXT)"
+    )
+    conn.commit()
+    conn.close()
+
+def db_get(key: str):
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        row = conn.execute("SELECT value FROM session WHERE key=?", (key,)).fetchone()
+        conn.close()
+        return row[0] if row else None
+    except Exception:
+        return None
+
+def db_set(key: str, value: str):
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute(
+            "INSERT OR REPLACE INTO session (key, value) VALUES (?, ?)", (key, value)
+        )
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        st.warning(f"DB write failed: {e}")
+
+def db_delete(key: str):
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute("DELETE FROM session WHERE key=?", (key,))
+        conn.commit()
+        conn.close()
+    except Exception:
+        pass
+
+# -------------------------------
+# Authenticated Client
+# -------------------------------
+@st.cache_resource
+def get_kite(access_token: str):
+    """
+    Authenticated client cached across reruns. KiteConnect holds a
+    requests.Session internally, so reusing one instance keeps its
+    connection pool (and TLS sessions) alive between widget clicks.
+    """
+    k = KiteConnect(api_key=st.secrets["kite"]["api_key"])
+    k.set_access_token(access_token)
+    try:
+        # Widen the session's connection pool past the requests default
+        # of 10 so every fetch worker reuses a keep-alive socket instead
+        # of queueing for one (or opening a fresh TLS connection).
+        k.reqsession.mount(
+            "https://", HTTPAdapter(pool_connections=16, pool_maxsize=16)
+        )
+    except Exception:
+        pass  # older/newer kiteconnect without reqsession still works
+    return k
+
+# -------------------------------
+# Instruments Cache
+# -------------------------------
+@st.cache_resource(ttl=86400)
+def load_instruments():
+    # Disk-backed cache keyed by date: survives Streamlit restarts and
+    # redeploys, so a cold start skips the ~2 MB instruments download.
+    # The in-process entry needs its own daily TTL — without it the
+    # date key is evaluated once and frozen, so a server running past
+    # midnight would never look at the new day's file.
+    path = Path(f".instruments_NSE_{date.today()}.parquet")
+    if path.exists():
+        return pd.read_parquet(path)
+    kite = get_kite(st.session_state["access_token"])
+    df = pd.DataFrame(kite.instruments("NSE"))
+    try:
+        for stale in Path(".").glob(".instruments_NSE_*.parquet"):
+            stale.unlink()
+        df.to_parquet(path, compression="zstd")
+    except Exception:
+        pass  # disk cache is best-effort; the in-process copy still works
+    return df
+
+@st.cache_data(ttl=3600)
+def load_token_map():
+    df = load_instruments()
+    return dict(
+        zip(df["tradingsymbol"].astype(str), df["instrument_token"].astype(int))
+    )
+
+def get_token(symbol: str):
+    return load_token_map().get(symbol)
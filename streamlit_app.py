@@ -4,10 +4,17 @@ import pandas as pd
 from datetime import datetime, timedelta
 import time
 from pathlib import Path
-import sqlite3
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import concurrent.futures
 import threading
 
+from auth import (
+    init_db, db_get, db_set, db_delete,
+    get_kite, load_token_map,
+)
+
 # -------------------------------
 # Streamlit Page Config
 # -------------------------------
@@ -15,51 +22,10 @@ st.set_page_config(page_title="Kite OHLCV Extractor", layout="centered")
 st.title("📈 Kite OHLCV Extractor")
 st.write(
     "Upload a CSV with column **symbol**, fetch OHLCV data from Kite API, "
-    "and auto-save results to CSV periodically to avoid data loss & memory issues."
+    "and auto-save results to Parquet periodically to avoid data loss & memory issues."
 )
 
-# -------------------------------
-# SQLite Token Persistence
-# -------------------------------
-DB_PATH = "kite_session.db"
-
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute(
-        "CREATE TABLE IF NOT EXISTS session (key TEXT PRIMARY KEY, value TEXT)"
-    )
-    conn.commit()
-    conn.close()
-
-def db_get(key: str):
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        row = conn.execute("SELECT value FROM session WHERE key=?", (key,)).fetchone()
-        conn.close()
-        return row[0] if row else None
-    except Exception:
-        return None
-
-def db_set(key: str, value: str):
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.execute(
-            "INSERT OR REPLACE INTO session (key, value) VALUES (?, ?)", (key, value)
-        )
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        st.warning(f"DB write failed: {e}")
-
-def db_delete(key: str):
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.execute("DELETE FROM session WHERE key=?", (key,))
-        conn.commit()
-        conn.close()
-    except Exception:
-        pass
-
+# Session persistence lives in auth.py (shared with auxiliary pages).
 init_db()
 
 # -------------------------------
@@ -110,7 +76,9 @@ if not st.session_state["access_token"]:
     st.info("Please login using the link above to continue.")
     st.stop()
 
-kite.set_access_token(st.session_state["access_token"])
+# From here on, use the cached authenticated client so the underlying
+# connection pool survives reruns instead of being rebuilt each script run.
+kite = get_kite(st.session_state["access_token"])
 
 st.success("Logged into Kite")
 with st.expander("Session Token (click to reveal)", expanded=False):
@@ -170,61 +138,112 @@ class RateLimiter:
 # Single shared limiter: 3 req/sec for historical data endpoint
 _rate_limiter = RateLimiter(rate=3.0)
 
-# -------------------------------
-# Helper: Instruments Cache
-# -------------------------------
-@st.cache_data(ttl=3600)
-def load_instruments():
-    df = pd.DataFrame(kite.instruments("NSE"))
-    return df
-
-def get_token(symbol: str):
-    df = load_instruments()
-    row = df[df["tradingsymbol"] == symbol]
-    if row.empty:
-        return None
-    return int(row.iloc[0]["instrument_token"])
-
 # -------------------------------
 # Autosave File Management
 # -------------------------------
-def init_autosave_file():
-    if "autosave_path" not in st.session_state:
-        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        st.session_state["autosave_path"] = str(
-            Path(f"ohlcv_autosave_{ts}.csv").resolve()
-        )
-    return st.session_state["autosave_path"]
+def new_autosave_path():
+    """Fresh timestamped autosave path; remembered for resume detection."""
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    path = str(Path(f"ohlcv_autosave_{ts}.parquet").resolve())
+    st.session_state["autosave_path"] = path
+    return path
+
+def valid_autosave(path):
+    """
+    True if the file has an intact Parquet footer. A run killed by a
+    restart/OOM never reaches writer.close(), leaving a footer-less file
+    that can't be read — don't offer those for resume.
+    """
+    try:
+        pq.ParquetFile(path)
+        return True
+    except Exception:
+        return False
+
+def latest_autosave():
+    """Most recent readable autosave on disk, if any (resume after a restart)."""
+    files = sorted(Path(".").glob("ohlcv_autosave_*.parquet"), reverse=True)
+    for f in files:
+        if valid_autosave(f):
+            return f
+    return None
 
 _write_lock = threading.Lock()
 
-def flush_buffer_to_csv(buffer, autosave_path, file_written_flag):
-    if not buffer:
-        return file_written_flag
-    df_buffer = pd.DataFrame(buffer)
+# Typed columnar schema for the autosave file. Kite timestamps are IST.
+OHLCV_SCHEMA = pa.schema([
+    ("symbol", pa.string()),
+    ("date",   pa.timestamp("s", tz="Asia/Kolkata")),
+    ("open",   pa.float32()),
+    ("high",   pa.float32()),
+    ("low",    pa.float32()),
+    ("close",  pa.float32()),
+    ("volume", pa.int64()),
+    ("error",  pa.string()),
+])
+
+# Rows buffered before each flush. Large enough to amortize row-group
+# overhead (tiny row-groups hurt both write and scan), small enough to
+# keep the buffer well under typical Streamlit memory limits.
+FLUSH_ROWS = 50_000
+
+def error_row(sym, err):
+    """Row tuple for a symbol that produced no data, in OHLCV_SCHEMA order."""
+    return (sym, None, None, None, None, None, None, err)
+
+class RowBuffer:
+    """
+    Column-wise (structure-of-arrays) buffer: one list per OHLCV_SCHEMA
+    field. Workers hand back ready-made columns, so no per-row tuple or
+    dict objects exist between fetch and flush, and the columns feed
+    RecordBatch.from_arrays with no transpose.
+    """
+    def __init__(self):
+        self.cols = tuple([] for _ in OHLCV_SCHEMA.names)
+
+    def __len__(self):
+        return len(self.cols[0])
+
+    def append_row(self, *values):
+        for col, value in zip(self.cols, values):
+            col.append(value)
+
+    def extend_cols(self, cols):
+        for col, new in zip(self.cols, cols):
+            col.extend(new)
+
+    def clear(self):
+        for col in self.cols:
+            col.clear()
+
+def flush_buffer(writer, buffer):
+    """Write the buffered columns as one Parquet row-group and clear the buffer."""
+    if not len(buffer):
+        return
+    batch = pa.RecordBatch.from_arrays(
+        [
+            pa.array(col, type=field.type)
+            for col, field in zip(buffer.cols, OHLCV_SCHEMA)
+        ],
+        schema=OHLCV_SCHEMA,
+    )
     with _write_lock:
-        df_buffer.to_csv(
-            autosave_path,
-            mode="a",
-            header=not file_written_flag,
-            index=False,
-        )
-    return True
+        writer.write_batch(batch)
+    buffer.clear()
 
 # -------------------------------
 # Worker: Fetch one symbol
 # Rate-limited to 3 req/sec via shared RateLimiter
 # -------------------------------
+def error_cols(sym, err):
+    """Single error row in column form, for fetch_symbol's return shape."""
+    return tuple([v] for v in error_row(sym, err))
+
 def fetch_symbol(args):
     sym, token_id, from_dt, to_dt = args
-    rows = []
 
     if token_id is None:
-        rows.append(dict(
-            symbol=sym, date=None, open=None, high=None,
-            low=None, close=None, volume=None, error="Token not found"
-        ))
-        return rows
+        return error_cols(sym, "Token not found")
 
     _rate_limiter.acquire()   # blocks until within the 3 req/sec budget
 
@@ -235,21 +254,22 @@ def fetch_symbol(args):
             to_date=to_dt,
             interval="day",
         )
-        for r in data:
-            rows.append(dict(
-                symbol=sym, date=r.get("date"), open=r.get("open"),
-                high=r.get("high"), low=r.get("low"), close=r.get("close"),
-                volume=r.get("volume"), error=None
-            ))
+        n = len(data)
+        return (
+            [sym] * n,
+            [r.get("date") for r in data],
+            [r.get("open") for r in data],
+            [r.get("high") for r in data],
+            [r.get("low") for r in data],
+            [r.get("close") for r in data],
+            [r.get("volume") for r in data],
+            [None] * n,
+        )
     except Exception as e:
         err = str(e)
         if "429" in err:
             err = "HTTP 429 Too Many Requests — rate limit exceeded"
-        rows.append(dict(
-            symbol=sym, date=None, open=None, high=None,
-            low=None, close=None, volume=None, error=err
-        ))
-    return rows
+        return error_cols(sym, err)
 
 # -------------------------------
 # CSV Upload
@@ -259,7 +279,20 @@ st.subheader("2 Upload CSV with column 'symbol'")
 uploaded = st.file_uploader("Upload CSV", type=["csv"], key="symbols_uploader")
 
 if uploaded is not None:
-    df_symbols = pd.read_csv(uploaded)
+    try:
+        # Arrow's multithreaded parser: much faster and leaner on large
+        # watchlists, and the arrow-backed frame hands columns to the
+        # Parquet autosave path without a pandas->arrow conversion.
+        df_symbols = pd.read_csv(uploaded, engine="pyarrow", dtype_backend="pyarrow")
+    except Exception:
+        uploaded.seek(0)
+        df_symbols = pd.read_csv(uploaded)
+    if "symbol" in df_symbols.columns:
+        # Normalize once at upload so every downstream consumer (token
+        # map, LTP probe, resume done-set) sees the same clean strings.
+        df_symbols["symbol"] = (
+            df_symbols["symbol"].astype(str).str.strip().str.upper()
+        )
     st.session_state["df_symbols"] = df_symbols
 elif "df_symbols" in st.session_state:
     df_symbols = st.session_state["df_symbols"]
@@ -271,8 +304,12 @@ if df_symbols is not None:
         st.error("CSV must contain column: symbol")
         st.stop()
 
-    st.write("Uploaded Symbols:")
-    st.dataframe(df_symbols)
+    # Collapsed and truncated so a 10k-row watchlist isn't re-sent over
+    # the websocket on every rerun (each widget click reruns the script).
+    with st.expander(f"Preview uploaded symbols ({len(df_symbols):,} rows)"):
+        st.dataframe(df_symbols.head(200))
+        if len(df_symbols) > 200:
+            st.caption(f"Showing first 200 of {len(df_symbols):,} symbols.")
 
     # -------------------------------
     # Fetch OHLCV
@@ -302,11 +339,6 @@ if df_symbols is not None:
         )
     )
 
-    flush_interval = st.number_input(
-        "Autosave every N seconds", min_value=10, max_value=120,
-        value=30, step=10
-    )
-
     total_syms  = len(df_symbols["symbol"])
     est_secs    = total_syms / 3.0
     est_mins    = int(est_secs // 60)
@@ -316,14 +348,49 @@ if df_symbols is not None:
         f"~{est_mins}m {est_sec_rem}s"
     )
 
+    # Offer to resume if a previous autosave survives (same session or a
+    # restart): its symbols are skipped and its rows carried over.
+    resume_from = None
+    prev_path = st.session_state.get("autosave_path")
+    if prev_path and Path(prev_path).exists() and valid_autosave(prev_path):
+        resume_from = Path(prev_path)
+    else:
+        resume_from = latest_autosave()
+
+    resume = False
+    if resume_from is not None:
+        resume = st.checkbox(
+            f"Resume from {resume_from.name} (skip symbols already saved)",
+            value=False,
+            key="resume_run",
+            help=(
+                "Symbols already in the autosave — including errored ones — "
+                "are not re-fetched; their saved rows are copied into the "
+                "new output file. Only symbols present in the current "
+                "upload are carried over. Leave unchecked if you changed "
+                "the date range: carried-over rows keep the dates they "
+                "were fetched with."
+            ),
+        )
+
     if st.button("Fetch Data", key="fetch_data_btn"):
-        autosave_path = init_autosave_file()
-        autosave_file = Path(autosave_path)
-        if autosave_file.exists():
+        done = set()
+        if resume and resume_from is not None:
             try:
-                autosave_file.unlink()
+                done = set(
+                    pq.read_table(resume_from, columns=["symbol"])
+                    .column("symbol")
+                    .to_pylist()
+                )
             except Exception as e:
-                st.warning(f"Could not remove old autosave file: {e}")
+                st.warning(
+                    f"Could not read {resume_from.name} ({e}); "
+                    "starting a fresh full run instead."
+                )
+                done = set()
+
+        autosave_path = new_autosave_path()
+        autosave_file = Path(autosave_path)
 
         st.info(f"Autosaving to: {autosave_path}")
 
@@ -331,87 +398,195 @@ if df_symbols is not None:
         status_ph   = st.empty()
         autosave_ph = st.empty()
 
-        symbols   = [str(s).strip().upper() for s in df_symbols["symbol"]]
-        total     = len(symbols)
-
-        # Resolve tokens upfront (cached, no rate-limit impact)
+        # Resolve tokens upfront in one vectorized pass (cached, no
+        # rate-limit impact). Symbols are normalized at upload; unknown
+        # ones surface as NaN.
         status_ph.write("Resolving instrument tokens...")
-        token_map = {sym: get_token(sym) for sym in symbols}
+        tokens  = df_symbols["symbol"].map(load_token_map())
+        symbols = df_symbols["symbol"].tolist()
+        total   = len(symbols)
 
         from_dt = datetime.combine(from_date, datetime.min.time())
         to_dt   = datetime.combine(to_date,   datetime.max.time())
 
-        args_list = [(sym, token_map[sym], from_dt, to_dt) for sym in symbols]
-
-        rows_buffer  = []
-        file_written = False
-        last_flush   = time.time()
-        completed    = 0
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = {
-                executor.submit(fetch_symbol, args): args[0]
-                for args in args_list
-            }
-
-            for future in concurrent.futures.as_completed(futures):
-                sym = futures[future]
-                completed += 1
-                status_ph.write(f"Done: {sym} ({completed}/{total})")
-
+        args_list = [
+            (sym, None if pd.isna(token) else int(token), from_dt, to_dt)
+            for sym, token in zip(symbols, tokens)
+        ]
+
+        skipped = 0
+        if done:
+            before = len(args_list)
+            args_list = [a for a in args_list if a[0] not in done]
+            skipped = before - len(args_list)
+
+        # One bulk LTP probe (up to 500 symbols per request) prunes
+        # delisted/untraded symbols before spending a rate-limited
+        # historical_data call on each of them.
+        status_ph.write("Probing symbols via bulk LTP...")
+        probe_syms = [a[0] for a in args_list if a[1] is not None]
+        live = set()
+        try:
+            for start in range(0, len(probe_syms), 500):
+                chunk = probe_syms[start:start + 500]
+                ltp = kite.ltp([f"NSE:{s}" for s in chunk])
+                live.update(k.split(":", 1)[1] for k in ltp)
+        except Exception as e:
+            st.warning(f"Bulk LTP probe failed ({e}); fetching all symbols.")
+            live = set(probe_syms)
+
+        dead = [a[0] for a in args_list if a[1] is not None and a[0] not in live]
+        args_list = [a for a in args_list if a[1] is None or a[0] in live]
+
+        rows_buffer = RowBuffer()
+        for sym in dead:
+            rows_buffer.append_row(*error_row(sym, "No LTP — delisted or not traded"))
+        completed   = len(dead) + skipped
+        last_pct    = -1
+
+        # One writer held open for the whole run: each flush lands as a
+        # typed, zstd-compressed row-group with no DataFrame round-trip.
+        writer = pq.ParquetWriter(autosave_path, OHLCV_SCHEMA, compression="zstd")
+
+        try:
+            # Parquet files can't be appended in place, so a resumed run
+            # streams the old file's row-groups into the new writer
+            # first — bounded memory, no re-fetching.
+            if skipped:
+                status_ph.write(
+                    f"Carrying over {skipped} symbols from {resume_from.name}..."
+                )
+                # Carry only rows for symbols in the current upload, so a
+                # resumed run with an edited watchlist doesn't inject
+                # removed symbols' rows into the new output.
+                carry = pa.array([s for s in symbols if s in done])
                 try:
-                    rows = future.result()
-                    rows_buffer.extend(rows)
+                    for batch in pq.ParquetFile(resume_from).iter_batches():
+                        batch = batch.filter(
+                            pc.is_in(batch.column("symbol"), value_set=carry)
+                        )
+                        if batch.num_rows:
+                            writer.write_batch(batch)
                 except Exception as e:
-                    rows_buffer.append(dict(
-                        symbol=sym, date=None, open=None, high=None,
-                        low=None, close=None, volume=None, error=str(e)
-                    ))
-
-                now = time.time()
-                should_flush = (
-                    now - last_flush >= flush_interval
-                    or len(rows_buffer) >= 5000
-                    or completed == total
-                )
-
-                if should_flush and rows_buffer:
-                    file_written = flush_buffer_to_csv(
-                        rows_buffer, autosave_path, file_written
+                    st.warning(
+                        f"Carry-over from {resume_from.name} stopped early "
+                        f"({e}); skipped symbols may be missing rows — "
+                        "re-run with resume unchecked to re-fetch them."
                     )
-                    last_flush = now
-                    autosave_ph.success(
-                        f"Autosaved {len(rows_buffer)} rows at "
-                        f"{datetime.now().strftime('%H:%M:%S')}"
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    executor.submit(fetch_symbol, args): args[0]
+                    for args in args_list
+                }
+
+                for future in concurrent.futures.as_completed(futures):
+                    sym = futures[future]
+                    completed += 1
+                    # Throttle UI updates: every st.progress/status write
+                    # is a websocket frame that blocks the fetch loop, so
+                    # only push whole-percent and every-10th-symbol steps.
+                    if completed % 10 == 0 or completed == total:
+                        status_ph.write(f"Done: {sym} ({completed}/{total})")
+
+                    try:
+                        rows_buffer.extend_cols(future.result())
+                    except Exception as e:
+                        rows_buffer.append_row(*error_row(sym, str(e)))
+
+                    should_flush = (
+                        len(rows_buffer) >= FLUSH_ROWS
+                        or completed == total
                     )
-                    rows_buffer = []
 
-                progress.progress(completed / total)
+                    if should_flush and rows_buffer:
+                        flushed = len(rows_buffer)
+                        flush_buffer(writer, rows_buffer)
+                        autosave_ph.success(
+                            f"Autosaved {flushed} rows at "
+                            f"{datetime.now().strftime('%H:%M:%S')}"
+                        )
+
+                    pct = int(100 * completed / total)
+                    if pct != last_pct:
+                        progress.progress(pct / 100)
+                        last_pct = pct
+
+            # Catch anything still buffered (e.g. every symbol pruned by
+            # the LTP probe, so the as_completed loop never ran).
+            flush_buffer(writer, rows_buffer)
+        finally:
+            writer.close()
 
         st.success("Data fetching completed!")
 
         if autosave_file.exists():
             try:
-                df_out = pd.read_csv(autosave_file)
-                errors = df_out[df_out["error"].notna()]
-                st.write(f"Preview (first 500 of {len(df_out):,} rows):")
-                st.dataframe(df_out.head(500))
-                if not errors.empty:
+                # Preview reads only the first 500 rows; the row count
+                # comes from file metadata and the error summary from a
+                # two-column read, so the full table is never loaded
+                # just to render a head().
+                pf = pq.ParquetFile(autosave_file)
+                total_rows = pf.metadata.num_rows
+                first = next(pf.iter_batches(batch_size=500), None)
+                df_head = (
+                    first.to_pandas() if first is not None
+                    else pd.DataFrame(columns=OHLCV_SCHEMA.names)
+                )
+                st.write(f"Preview (first {len(df_head)} of {total_rows:,} rows):")
+                st.dataframe(df_head)
+
+                err_df = pq.read_table(
+                    autosave_file, columns=["symbol", "error"]
+                ).to_pandas()
+                n_bad = err_df.loc[err_df["error"].notna(), "symbol"].nunique()
+                if n_bad:
                     st.warning(
-                        f"{len(errors['symbol'].unique())} symbol(s) had errors — "
+                        f"{n_bad} symbol(s) had errors — "
                         "check the 'error' column in the download."
                     )
+            except Exception as e:
+                st.error(
+                    f"File saved at {autosave_path} but preview failed: {e}. "
+                    "Access it directly on the server."
+                )
+
+            # Downloads live outside the preview try-block so a preview
+            # failure can't hide them after a long fetch.
+            try:
+                # Hand Streamlit the open file handle rather than
+                # f.read(): it reads the bytes once itself, with no
+                # extra whole-file copy sitting in Python first.
                 with open(autosave_file, "rb") as f:
                     st.download_button(
-                        label="Download Complete OHLCV CSV",
-                        data=f.read(),
+                        label="Download Complete OHLCV Parquet",
+                        data=f,
+                        file_name="ohlcv_output.parquet",
+                        mime="application/octet-stream",
+                    )
+                # Convert to CSV batch by batch into a sidecar file so
+                # the full dataset is never materialized in RAM, then
+                # hand the button a file handle like the Parquet path.
+                csv_path = autosave_file.with_suffix(".csv")
+                with open(csv_path, "w", newline="") as out:
+                    header = True
+                    for batch in pq.ParquetFile(autosave_file).iter_batches():
+                        batch.to_pandas().to_csv(
+                            out, index=False, header=header,
+                            float_format="%.2f",
+                        )
+                        header = False
+                with open(csv_path, "rb") as f:
+                    st.download_button(
+                        label="Download as CSV",
+                        data=f,
                         file_name="ohlcv_output.csv",
                         mime="text/csv",
                     )
             except Exception as e:
                 st.error(
-                    f"File saved at {autosave_path} but preview failed: {e}. "
-                    "Access it directly on the server."
+                    f"Download buttons unavailable ({e}); the file is at "
+                    f"{autosave_path} on the server."
                 )
         else:
             st.error(